@@ -0,0 +1,3 @@
+from py64pixels.client.keepalive import *
+from py64pixels.client.outqueue import *
+from py64pixels.client.world import *
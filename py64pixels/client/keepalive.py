@@ -0,0 +1,115 @@
+from time import monotonic
+from math import ceil
+from struct import error as StructError
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional, Tuple
+from py64pixels.packets.utils import PacketReader, PacketDecoder
+from py64pixels.packets.base import BasePacket
+from py64pixels.packets.packets import decoder, PingPacket, PongPacket
+from py64pixels.packets.constants import PKID_CLIENT_PING, PKID_CLIENT_PONG
+
+__all__ = [ 'LatencyHistogram', 'KeepAlive' ]
+
+PING_DATA = bytes([PKID_CLIENT_PING])
+PONG_DATA = bytes([PKID_CLIENT_PONG])
+
+
+class LatencyHistogram:
+    def __init__(self, size: int = 256):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[max(0, ceil(p * len(ordered) / 100) - 1)]
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self.percentile(50)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self.percentile(95)
+
+    @property
+    def p99(self) -> Optional[float]:
+        return self.percentile(99)
+
+
+class KeepAlive:
+    # Decodes packets in place of `decoder.read_one`, answering server pings
+    # as soon as they are decoded. Use `read_all()` on each received buffer
+    # before dispatching any of its packets, so a ping never waits behind
+    # handlers of the packets in front of it. A trailing partial packet is
+    # left unread in `pr.junk`, to be prepended to the next received data. `rtt` holds network round trips
+    # of our own pings, `dispatch` holds the time between decoding a packet
+    # and `handled()` being called with its decode timestamp.
+    def __init__(self, send: Callable[[bytes], Any],
+                 interval: float = 5.0, timeout: float = 15.0,
+                 window: int = 256, decoder: PacketDecoder = decoder,
+                 clock: Callable[[], float] = monotonic):
+        self.send = send
+        self.interval = interval
+        self.timeout = timeout
+        self.decoder = decoder
+        self.clock = clock
+        self.rtt = LatencyHistogram(window)
+        self.dispatch = LatencyHistogram(window)
+        self.lost = 0
+        self._last_ping: Optional[float] = None
+        self._pending_ping: Optional[float] = None
+
+    def read_one(self, pr: PacketReader) -> Tuple[BasePacket, float]:
+        pkt = self.decoder.read_one(pr)
+        now = self.clock()
+        if isinstance(pkt, PingPacket):
+            self.send(PONG_DATA)
+        elif isinstance(pkt, PongPacket) and self._pending_ping is not None:
+            self.rtt.add(now - self._pending_ping)
+            self._pending_ping = None
+        return pkt, now
+
+    def read_all(self, pr: PacketReader) -> List[Tuple[BasePacket, float]]:
+        data = pr.getvalue()
+        size = len(data)
+        packets = []
+        while True:
+            start = pr.tell()
+            end = start
+            while end < size and data[end] == 0:
+                end += 1
+            if end == size:
+                pr.seek(end)
+                return packets
+            try:
+                packets.append(self.read_one(pr))
+            except (IndexError, StructError, EOFError):
+                pr.seek(start)
+                return packets
+
+    def handled(self, decoded_at: float):
+        self.dispatch.add(self.clock() - decoded_at)
+
+    def tick(self) -> bool:
+        now = self.clock()
+        if self._pending_ping is not None:
+            if now - self._pending_ping < self.timeout:
+                return False
+            # wait another interval, so a late pong is not taken for the
+            # answer to the next ping
+            self.lost += 1
+            self._pending_ping = None
+            self._last_ping = now
+            return False
+        if self._last_ping is not None and now - self._last_ping < self.interval:
+            return False
+        self.send(PING_DATA)
+        self._last_ping = self._pending_ping = now
+        return True
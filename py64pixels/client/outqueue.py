@@ -0,0 +1,174 @@
+from time import monotonic
+from struct import pack, unpack
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, List, Set, Tuple
+from py64pixels.packets.constants import *
+
+__all__ = [ 'TokenBucket', 'OutgoingQueue' ]
+__all__ += [ 'LANE_CONTROL', 'LANE_MOVE', 'LANE_ACTION', 'LANE_BUILD',
+             'LANE_CHAT' ]
+
+LANE_CONTROL = 0
+LANE_MOVE = 1
+LANE_ACTION = 2
+LANE_BUILD = 3
+LANE_CHAT = 4
+
+# Like the server ones, compressed moves carry the direction in low two bits
+CLIENT_MOVE_COMPRESSED = tuple(range(PKID_CLIENT_MOVE_COMPRESSED,
+                                     PKID_CLIENT_MOVE_COMPRESSED + 4))
+# Moves made obsolete by a newer absolute move
+SUPERSEDED_MOVES = (PKID_CLIENT_MOVE_DELTA, PKID_CLIENT_MOVE_ABSOLUTE) \
+    + CLIENT_MOVE_COMPRESSED
+
+DEFAULT_LANES = {
+    PKID_CLIENT_LOGIN: LANE_CONTROL,
+    PKID_CLIENT_DISCONNECT: LANE_CONTROL,
+    PKID_CLIENT_DECRYPTED_DATA: LANE_CONTROL,
+    PKID_CLIENT_PING: LANE_CONTROL,
+    PKID_CLIENT_PONG: LANE_CONTROL,
+    PKID_CLIENT_MOVE_DELTA: LANE_MOVE,
+    PKID_CLIENT_MOVE_ABSOLUTE: LANE_MOVE,
+    **{pkid: LANE_MOVE for pkid in CLIENT_MOVE_COMPRESSED},
+    PKID_CLIENT_RESPAWN: LANE_MOVE,
+    PKID_CLIENT_SHOOT: LANE_ACTION,
+    PKID_CLIENT_PUSH: LANE_ACTION,
+    PKID_CLIENT_CHUNK_REQUEST: LANE_ACTION,
+    PKID_CLIENT_PUT_BLOCK: LANE_BUILD,
+    PKID_CLIENT_CHAT: LANE_CHAT,
+}
+
+PAYLOAD_SIZES = {
+    PKID_CLIENT_MOVE_DELTA: 2,
+    PKID_CLIENT_MOVE_ABSOLUTE: 8,
+}
+
+INT8_RANGE = range(-0x80, 0x80)
+INT32_RANGE = range(-0x80000000, 0x80000000)
+
+# packets per second, burst size
+DEFAULT_LIMITS = {
+    PKID_CLIENT_PUT_BLOCK: (64, 128),
+    PKID_CLIENT_CHAT: (1, 3),
+    PKID_CLIENT_SHOOT: (10, 10),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float,
+                 clock: Callable[[], float] = monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock
+        self._updated = clock()
+
+    def take(self, n: float = 1) -> bool:
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+
+class OutgoingQueue:
+    # Packets are queued as (pkid, payload) pairs into per-class lanes and
+    # written out by `flush()`, highest priority lane first, into a single
+    # buffer. The returned view is only valid until the next flush. Packets
+    # whose type ran out of tokens are skipped without holding back other
+    # types queued behind them in the same lane.
+    # Client moves are assumed to mirror the server ones without player id:
+    # delta is (dx: c_int8, dy: c_int8), absolute is (x: c_int32, y: c_int32).
+    def __init__(self, buffer_size: int = 4096,
+                 lanes: Dict[int, int] = DEFAULT_LANES,
+                 limits: Dict[int, Tuple[float, float]] = DEFAULT_LIMITS,
+                 default_lane: int = LANE_ACTION,
+                 clock: Callable[[], float] = monotonic):
+        self.lanes = dict(lanes)
+        self.default_lane = default_lane
+        self._queues: List[Deque[List]] = [
+            deque() for _ in range(max([default_lane, *lanes.values()]) + 1)
+        ]
+        self._lane_pkids: List[Set[int]] = [set() for _ in self._queues]
+        self._counts: Counter = Counter()
+        self._buckets = {
+            pkid: TokenBucket(rate, burst, clock)
+            for pkid, (rate, burst) in limits.items()
+        }
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+    def __len__(self):
+        return sum(map(len, self._queues))
+
+    def put(self, pkid: int, payload: bytes = b''):
+        if len(payload) + 1 > len(self._buffer):
+            raise ValueError('packet %.2x does not fit into buffer' % pkid)
+        if len(payload) != PAYLOAD_SIZES.get(pkid, len(payload)):
+            raise ValueError('packet %.2x payload must be %d bytes long'
+                             % (pkid, PAYLOAD_SIZES[pkid]))
+        lane = self.lanes.get(pkid, self.default_lane)
+        queue = self._queues[lane]
+        if pkid == PKID_CLIENT_MOVE_DELTA and queue:
+            if self._fold_delta(queue[-1], *unpack('bb', payload)):
+                return
+        elif pkid == PKID_CLIENT_MOVE_ABSOLUTE:
+            for item in [i for i in queue if i[0] in SUPERSEDED_MOVES]:
+                queue.remove(item)
+                self._counts[item[0]] -= 1
+        queue.append([pkid, bytes(payload)])
+        self._lane_pkids[lane].add(pkid)
+        self._counts[pkid] += 1
+
+    def move_delta(self, dx: int, dy: int):
+        self.put(PKID_CLIENT_MOVE_DELTA, pack('bb', dx, dy))
+
+    def move_absolute(self, x: int, y: int):
+        self.put(PKID_CLIENT_MOVE_ABSOLUTE, pack('!ii', x, y))
+
+    def _fold_delta(self, last: List, dx: int, dy: int) -> bool:
+        if last[0] == PKID_CLIENT_MOVE_ABSOLUTE:
+            x, y = unpack('!ii', last[1])
+            if x + dx in INT32_RANGE and y + dy in INT32_RANGE:
+                last[1] = pack('!ii', x + dx, y + dy)
+                return True
+        elif last[0] == PKID_CLIENT_MOVE_DELTA:
+            ldx, ldy = unpack('bb', last[1])
+            if ldx + dx in INT8_RANGE and ldy + dy in INT8_RANGE:
+                last[1] = pack('bb', ldx + dx, ldy + dy)
+                return True
+        return False
+
+    def flush(self) -> memoryview:
+        buffer, offset, size = self._buffer, 0, len(self._buffer)
+        for queue, pkids in zip(self._queues, self._lane_pkids):
+            throttled: Set[int] = set()
+            skipped = []
+            full = False
+            while queue:
+                pkid, payload = queue[0]
+                if pkid not in throttled:
+                    end = offset + 1 + len(payload)
+                    if end > size:
+                        full = True
+                        break
+                    bucket = self._buckets.get(pkid)
+                    if bucket is None or bucket.take():
+                        buffer[offset] = pkid
+                        buffer[offset + 1:end] = payload
+                        offset = end
+                        queue.popleft()
+                        self._counts[pkid] -= 1
+                        continue
+                    throttled.add(pkid)
+                    if all(p in throttled or not self._counts[p]
+                           for p in pkids):
+                        break
+                skipped.append(queue.popleft())
+            queue.extendleft(reversed(skipped))
+            if full:
+                break
+        return self._view[:offset]
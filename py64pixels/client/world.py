@@ -0,0 +1,261 @@
+from struct import Struct
+from ctypes import c_int8, c_uint8, c_uint16, c_int32, c_uint32, c_char
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from py64pixels.packets.utils import PacketReader, str8
+from py64pixels.packets.base import BasePacket
+from py64pixels.packets.packets import *
+
+__all__ = [ 'WorldState', 'WorldService' ]
+
+KIND_SNAPSHOT = 0x53
+KIND_DELTA = 0x44
+
+# kind, tick, cells count, players count, chunks count
+HEADER = Struct('!BIIHH')
+# present, x, y, type, char, color
+CELL = Struct('!?iibcB')
+# present, player id, x, y, char, color; followed by name as str8
+PLAYER = Struct('!?biicB')
+# chunk type, chunk x, chunk y, data length; followed by data
+CHUNK = Struct('!BiiI')
+
+# Cell type recorded for blocks from PlacePushablePlayerPacket, which does
+# not carry one
+PUSHABLE_TYPE = 2
+
+Cell = Tuple[int, bytes, int]
+ChunkKey = Tuple[int, int, int]
+
+
+def wrap_int32(value: int) -> int:
+    return (value + 0x80000000) % 0x100000000 - 0x80000000
+
+
+class WorldState:
+    # Map cells and players as seen through decoded packets. Changes are
+    # tracked between `diff()` calls, which encode them along with the tick
+    # number; `snapshot()` encodes everything. Both are loaded back with
+    # `apply_diff()`.
+    # Map data sent by the server is kept as opaque payloads in `chunks`, keyed
+    # by (chunk_type, chunk_x, chunk_y); observers decode those themselves and
+    # lay `cells` over them.
+    def __init__(self):
+        self.tick = 0
+        self.cells: Dict[Tuple[int, int], Cell] = {}
+        self.players: Dict[int, List] = {}
+        self.chunks: Dict[ChunkKey, bytes] = {}
+        self._changed_cells: Set[Tuple[int, int]] = set()
+        self._changed_players: Set[int] = set()
+        self._changed_chunks: Set[ChunkKey] = set()
+        self._chunk: Optional[Tuple[ChunkKey, bytearray]] = None
+        self._handlers: Dict[type, Callable[[Any], None]] = {
+            PlaceBlockMapPacket: self._on_place_block,
+            PlaceBlockPlayerPacket: self._on_place_block,
+            ClearBlockMapPacket: self._on_clear_block,
+            PlacePushablePlayerPacket: self._on_place_pushable,
+            PushPacket: self._on_move_region,
+            PullPacket: self._on_move_region,
+            SpawnPacket: self._on_spawn,
+            DespawnPacket: self._on_despawn,
+            AbsoluteMovePacket: self._on_absolute_move,
+            RelativeMovePacket: self._on_relative_move,
+            PlayerNicknamePacket: self._on_nickname,
+            DataStartPacket: self._on_data_start,
+            DataChunkPacket: self._on_data_chunk,
+            DataEndPacket: self._on_data_end,
+        }
+
+    def apply(self, pkt: BasePacket) -> bool:
+        handler = self._handlers.get(type(pkt))
+        if handler is None:
+            return False
+        handler(pkt)
+        return True
+
+    def _on_place_block(self, pkt):
+        self.cells[pkt.x, pkt.y] = (pkt.type, pkt.char, pkt.color)
+        self._changed_cells.add((pkt.x, pkt.y))
+
+    def _on_clear_block(self, pkt):
+        self.cells.pop((pkt.x, pkt.y), None)
+        self._changed_cells.add((pkt.x, pkt.y))
+
+    def _on_place_pushable(self, pkt):
+        target = (pkt.target_x, pkt.target_y)
+        self.cells[target] = (PUSHABLE_TYPE, pkt.char, pkt.color)
+        self._changed_cells.add(target)
+
+    def _on_move_region(self, pkt):
+        # Blocks inside start + size are shifted by move; both the vacated
+        # and the covered cells are reported as changed.
+        x_range = range(pkt.start_x, pkt.start_x + pkt.size_x)
+        y_range = range(pkt.start_y, pkt.start_y + pkt.size_y)
+        if len(x_range) * len(y_range) > len(self.cells):
+            moved = [pos for pos in self.cells
+                     if pos[0] in x_range and pos[1] in y_range]
+        else:
+            moved = [(x, y) for x in x_range for y in y_range
+                     if (x, y) in self.cells]
+        blocks = [(pos, self.cells.pop(pos)) for pos in moved]
+        for (x, y), cell in blocks:
+            target = (wrap_int32(x + pkt.move_x), wrap_int32(y + pkt.move_y))
+            self.cells[target] = cell
+            self._changed_cells.add((x, y))
+            self._changed_cells.add(target)
+
+    def _on_spawn(self, pkt):
+        self.players[pkt.player_id] = [
+            pkt.name, pkt.x, pkt.y, pkt.char, pkt.color
+        ]
+        self._changed_players.add(pkt.player_id)
+
+    def _on_despawn(self, pkt):
+        self.players.pop(pkt.player_id, None)
+        self._changed_players.add(pkt.player_id)
+
+    def _on_absolute_move(self, pkt):
+        player = self.players.get(pkt.user_id)
+        if player is not None:
+            player[1], player[2] = pkt.x, pkt.y
+            self._changed_players.add(pkt.user_id)
+
+    def _on_relative_move(self, pkt):
+        player = self.players.get(pkt.player_id)
+        if player is not None:
+            player[1] = wrap_int32(player[1] + pkt.dx)
+            player[2] = wrap_int32(player[2] + pkt.dy)
+            self._changed_players.add(pkt.player_id)
+
+    def _on_nickname(self, pkt):
+        player = self.players.get(pkt.player_id)
+        if player is not None:
+            player[0] = pkt.name
+            self._changed_players.add(pkt.player_id)
+
+    def _on_data_start(self, pkt):
+        key = (pkt.chunk_type, pkt.chunk_x, pkt.chunk_y)
+        self._chunk = (key, bytearray())
+
+    def _on_data_chunk(self, pkt):
+        if self._chunk is not None:
+            self._chunk[1].extend(pkt.data)
+
+    def _on_data_end(self, pkt):
+        if self._chunk is not None:
+            key, data = self._chunk
+            self.chunks[key] = bytes(data)
+            self._changed_chunks.add(key)
+            self._chunk = None
+
+    def _encode(self, kind: int, cells, players, chunks) -> bytes:
+        out = [HEADER.pack(kind, self.tick, len(cells), len(players),
+                           len(chunks))]
+        for (x, y) in cells:
+            cell = self.cells.get((x, y))
+            if cell is None:
+                out.append(CELL.pack(False, x, y, 0, b'\0', 0))
+            else:
+                out.append(CELL.pack(True, x, y, *cell))
+        for player_id in players:
+            player = self.players.get(player_id)
+            if player is None:
+                out.append(PLAYER.pack(False, player_id, 0, 0, b'\0', 0))
+                out.append(b'\0')
+            else:
+                name, x, y, char, color = player
+                name = name.encode('charmap')
+                out.append(PLAYER.pack(True, player_id, x, y, char, color))
+                out.append(bytes([len(name)]) + name)
+        for key in chunks:
+            data = self.chunks[key]
+            out.append(CHUNK.pack(*key, len(data)))
+            out.append(data)
+        return b''.join(out)
+
+    def diff(self) -> bytes:
+        self.tick += 1
+        data = self._encode(KIND_DELTA, self._changed_cells,
+                            self._changed_players, self._changed_chunks)
+        self._changed_cells = set()
+        self._changed_players = set()
+        self._changed_chunks = set()
+        return data
+
+    def snapshot(self) -> bytes:
+        return self._encode(KIND_SNAPSHOT, self.cells, self.players,
+                            self.chunks)
+
+    def apply_diff(self, data: bytes):
+        with PacketReader(data) as pr:
+            kind = pr.read_one(c_uint8)
+            tick = pr.read_one(c_uint32)
+            if kind == KIND_SNAPSHOT:
+                self.cells.clear()
+                self.players.clear()
+                self.chunks.clear()
+            elif kind != KIND_DELTA:
+                raise ValueError('unknown world data kind %.2x' % kind)
+            elif tick != self.tick + 1:
+                raise ValueError('expected tick %d, got %d'
+                                 % (self.tick + 1, tick))
+            self.tick = tick
+            n_cells, n_players = pr.read_one(c_uint32), pr.read_one(c_uint16)
+            n_chunks = pr.read_one(c_uint16)
+            for _ in range(n_cells):
+                present = pr.read_one(bool)
+                x, y = pr.read_one(c_int32), pr.read_one(c_int32)
+                cell = (pr.read_one(c_int8), pr.read_one(c_char),
+                        pr.read_one(c_uint8))
+                if present:
+                    self.cells[x, y] = cell
+                else:
+                    self.cells.pop((x, y), None)
+            for _ in range(n_players):
+                present = pr.read_one(bool)
+                player_id = pr.read_one(c_int8)
+                x, y = pr.read_one(c_int32), pr.read_one(c_int32)
+                char, color = pr.read_one(c_char), pr.read_one(c_uint8)
+                name = pr.read_one(str8)
+                if present:
+                    self.players[player_id] = [name, x, y, char, color]
+                else:
+                    self.players.pop(player_id, None)
+            for _ in range(n_chunks):
+                key = (pr.read_one(c_uint8), pr.read_one(c_int32),
+                       pr.read_one(c_int32))
+                self.chunks[key] = pr.read_exact(pr.read_one(c_uint32))
+
+
+class WorldService:
+    # Feeds decoded packets into a single WorldState and fans the same encoded
+    # deltas out to every observer. New observers get the latest snapshot
+    # followed by the deltas made since it was taken.
+    def __init__(self, snapshot_interval: int = 100):
+        self.snapshot_interval = snapshot_interval
+        self.world = WorldState()
+        self.observers: List[Callable[[bytes], Any]] = []
+        self.snapshot = self.world.snapshot()
+        self.deltas: List[bytes] = []
+
+    def feed(self, pkt: BasePacket) -> bool:
+        return self.world.apply(pkt)
+
+    def subscribe(self, send: Callable[[bytes], Any]):
+        send(self.snapshot)
+        for delta in self.deltas:
+            send(delta)
+        self.observers.append(send)
+
+    def unsubscribe(self, send: Callable[[bytes], Any]):
+        self.observers.remove(send)
+
+    def tick(self) -> bytes:
+        delta = self.world.diff()
+        for send in self.observers:
+            send(delta)
+        if len(self.deltas) + 1 >= self.snapshot_interval:
+            self.snapshot = self.world.snapshot()
+            self.deltas = []
+        else:
+            self.deltas.append(delta)
+        return delta
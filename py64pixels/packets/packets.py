@@ -6,7 +6,7 @@ from py64pixels.packets.constants import *
 
 decoder = PacketDecoder()
 
-__all__ = [ 'decoder', 'PacketReader' ]
+__all__ = [ 'decoder', 'PacketReader', 'StringCache' ]
 
 @decoder.register
 class LoginPacket(BasePacket):
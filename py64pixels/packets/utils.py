@@ -2,7 +2,8 @@ from ctypes import c_int8, c_uint8, c_int16, c_uint16, c_int32, c_uint32
 from ctypes import c_float, c_double, c_char
 from struct import pack, unpack
 from io import BytesIO
-from typing import Union, Any, NewType
+from collections import OrderedDict
+from typing import Union, Any, NewType, Optional
 
 c_type = type(c_int8)
 str8 = NewType('Str_sz8', str)
@@ -12,18 +13,62 @@ bytes16 = NewType('Bytes_sz16', bytes)
 bool42 = NewType('Bool42', bool)
 
 __all__ = [ 'str8', 'str16', 'bytes8', 'bytes16', 'bool42' ]
-__all__ += [ 'PacketReader', 'PacketDecoder' ]
+__all__ += [ 'PacketReader', 'PacketDecoder', 'StringCache' ]
+
+class StringCache:
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def decode(self, raw: bytes) -> str:
+        try:
+            value = self._cache[raw]
+        except KeyError:
+            self.misses += 1
+            value = self._cache[raw] = raw.decode('charmap')
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(raw)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+
 
 class PacketReader(BytesIO):
+    # `strings` optionally caches str8 decoding, so repeated names share one
+    # object. A StringCache is not thread-safe, give each reader thread its own.
+    # With `views` set, bytes16 fields are returned as memoryview slices of
+    # the underlying data instead of copies.
+    def __init__(self, initial_bytes: bytes = b'',
+                 strings: Optional[StringCache] = None,
+                 views: bool = False):
+        BytesIO.__init__(self, initial_bytes)
+        self.strings = strings
+        self.views = views
+
     def read_one(self, t: Union[type, c_type]) -> Any:
         if t == str8:
-            return self.read_one(bytes8).decode('charmap')
+            raw = self.read_exact(self.read_one(c_uint8))
+            if self.strings is None:
+                return raw.decode('charmap')
+            return self.strings.decode(raw)
         elif t == str16:
-            return self.read_one(bytes16).decode('charmap')
+            return self.read_exact(self.read_one(c_uint16)).decode('charmap')
         elif t == bytes8:
-            return self.read(self.read_one(c_uint8))
+            return self.read_exact(self.read_one(c_uint8))
         elif t == bytes16:
-            return self.read(self.read_one(c_uint16))
+            size = self.read_one(c_uint16)
+            if self.views:
+                return self.read_view(size)
+            return self.read_exact(size)
         elif t == bool42:
             return self.read_one(c_uint16) == 42
         elif t == bool:
@@ -45,10 +90,26 @@ class PacketReader(BytesIO):
         elif t == c_double:
             return unpack('!d', self.read(8))[0]
         elif t == c_char:
-            return self.read(1)
+            return self.read_exact(1)
         else:
             raise TypeError('unable to read %s' % t)
     
+    def read_exact(self, size: int) -> bytes:
+        data = self.read(size)
+        if len(data) != size:
+            raise EOFError('expected %d bytes, got %d' % (size, len(data)))
+        return data
+
+    def read_view(self, size: int) -> memoryview:
+        data = self.getvalue()
+        start = self.tell()
+        end = start + size
+        if end > len(data):
+            raise EOFError('expected %d bytes, got %d'
+                           % (size, len(data) - start))
+        self.seek(end)
+        return memoryview(data)[start:end]
+
     def atomic(self):
         return AtomicPacketReader(self)
     
@@ -62,7 +123,8 @@ class PacketReader(BytesIO):
 
 class AtomicPacketReader(PacketReader):
     def __init__(self, parent: PacketReader):
-        PacketReader.__init__(self, parent.getvalue())
+        PacketReader.__init__(self, parent.getvalue(),
+                              parent.strings, parent.views)
         self.seek(parent.tell())
         self._parent = parent
 
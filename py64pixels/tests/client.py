@@ -0,0 +1,368 @@
+import unittest
+from py64pixels.packets import *
+from py64pixels.packets.constants import *
+from py64pixels.client import *
+from py64pixels.client.world import PUSHABLE_TYPE
+from struct import pack
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        hist = LatencyHistogram()
+        self.assertIsNone(hist.p50)
+        self.assertEqual(len(hist), 0)
+
+    def test_percentiles(self):
+        hist = LatencyHistogram()
+        for value in range(1, 101):
+            hist.add(value)
+        self.assertEqual(hist.p50, 50)
+        self.assertEqual(hist.p95, 95)
+        self.assertEqual(hist.p99, 99)
+
+    def test_rolling(self):
+        hist = LatencyHistogram(size=4)
+        for value in (100, 1, 2, 3, 4):
+            hist.add(value)
+        self.assertEqual(len(hist), 4)
+        self.assertEqual(hist.p99, 4)
+
+
+class TestKeepAlive(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.clock = FakeClock()
+        self.keepalive = KeepAlive(self.sent.append, interval=5, timeout=10,
+                                   clock=self.clock)
+
+    def test_answer_ping(self):
+        with PacketReader(bytes([PKID_PING, PKID_CHAT, 1, 0])) as pr:
+            pkt, _ = self.keepalive.read_one(pr)
+            self.assertIsInstance(pkt, PingPacket)
+            self.assertEqual(self.sent, [bytes([PKID_CLIENT_PONG])])
+            pkt, _ = self.keepalive.read_one(pr)
+            self.assertIsInstance(pkt, ChatPacket)
+            self.assertEqual(len(self.sent), 1)
+
+    def test_read_all_answers_ping_first(self):
+        data = bytes([PKID_CHAT, 1, 0, PKID_HEALTH, 4, PKID_PING])
+        with PacketReader(data) as pr:
+            packets = self.keepalive.read_all(pr)
+            self.assertEqual(pr.junk, b'')
+        self.assertEqual(self.sent, [bytes([PKID_CLIENT_PONG])])
+        self.assertEqual([type(pkt) for pkt, _ in packets],
+                         [ChatPacket, HealthPacket, PingPacket])
+
+    def test_rtt(self):
+        self.assertTrue(self.keepalive.tick())
+        self.assertEqual(self.sent, [bytes([PKID_CLIENT_PING])])
+        self.clock.now = 0.25
+        self.assertFalse(self.keepalive.tick())
+        with PacketReader(bytes([PKID_PONG])) as pr:
+            self.assertIsInstance(self.keepalive.read_one(pr)[0], PongPacket)
+        self.assertEqual(self.keepalive.rtt.p50, 0.25)
+        self.clock.now = 4
+        self.assertFalse(self.keepalive.tick())
+        self.clock.now = 5
+        self.assertTrue(self.keepalive.tick())
+
+    def test_lost_ping(self):
+        self.keepalive.tick()
+        self.clock.now = 9
+        self.assertFalse(self.keepalive.tick())
+        self.clock.now = 10
+        self.assertFalse(self.keepalive.tick())
+        self.assertEqual(self.keepalive.lost, 1)
+        self.clock.now = 11
+        with PacketReader(bytes([PKID_PONG])) as pr:
+            self.keepalive.read_all(pr)
+        self.assertEqual(len(self.keepalive.rtt), 0)
+        self.clock.now = 14
+        self.assertFalse(self.keepalive.tick())
+        self.clock.now = 15
+        self.assertTrue(self.keepalive.tick())
+        self.assertEqual(len(self.sent), 2)
+
+    def test_read_all_partial(self):
+        with PacketReader(bytes.fromhex('f0 22 01 24 05 00 00')) as pr:
+            packets = self.keepalive.read_all(pr)
+            self.assertEqual(pr.junk, bytes.fromhex('24 05 00 00'))
+        self.assertEqual([type(pkt) for pkt, _ in packets],
+                         [PingPacket, DespawnPacket])
+        self.assertEqual(self.sent, [bytes([PKID_CLIENT_PONG])])
+        with PacketReader(bytes.fromhex('24 05 00 00 00 01 00 00 00 02'
+                                        'f5 05 6869')) as pr:
+            packets = self.keepalive.read_all(pr)
+            self.assertEqual(pr.junk, bytes.fromhex('f5 05 6869'))
+        [(pkt, _)] = packets
+        self.assertEqual((pkt.user_id, pkt.x, pkt.y), (5, 1, 2))
+
+    def test_read_all_padding(self):
+        with PacketReader(bytes.fromhex('f0 13 00 00')) as pr:
+            packets = self.keepalive.read_all(pr)
+            self.assertEqual(pr.junk, b'')
+        self.assertEqual([type(pkt) for pkt, _ in packets],
+                         [PingPacket, DataEndPacket])
+
+    def test_dispatch(self):
+        with PacketReader(bytes([PKID_PING])) as pr:
+            [(pkt, decoded_at)] = self.keepalive.read_all(pr)
+        self.clock.now = 0.5
+        self.keepalive.handled(decoded_at)
+        self.assertEqual(self.keepalive.dispatch.p50, 0.5)
+
+
+class TestOutgoingQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.queue = OutgoingQueue(buffer_size=64, clock=self.clock)
+
+    def test_priority(self):
+        self.queue.put(PKID_CLIENT_CHAT, b'\x02hi')
+        self.queue.put(PKID_CLIENT_PUT_BLOCK, b'\x01')
+        self.queue.move_delta(1, 0)
+        self.queue.put(PKID_CLIENT_PONG)
+        data = bytes(self.queue.flush())
+        self.assertEqual(data, bytes([PKID_CLIENT_PONG])
+                         + bytes([PKID_CLIENT_MOVE_DELTA]) + pack('bb', 1, 0)
+                         + bytes([PKID_CLIENT_PUT_BLOCK, 1])
+                         + bytes([PKID_CLIENT_CHAT, 2]) + b'hi')
+        self.assertEqual(len(self.queue), 0)
+
+    def test_fold_delta(self):
+        self.queue.move_delta(1, 0)
+        self.queue.move_delta(0, -1)
+        self.queue.move_delta(2, 3)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(bytes(self.queue.flush()),
+                         bytes([PKID_CLIENT_MOVE_DELTA]) + pack('bb', 3, 2))
+
+    def test_fold_delta_overflow(self):
+        self.queue.move_delta(100, 0)
+        self.queue.move_delta(100, 0)
+        self.assertEqual(len(self.queue), 2)
+
+    def test_absolute_replaces(self):
+        self.queue.move_delta(1, 1)
+        self.queue.move_absolute(10, 20)
+        self.queue.move_absolute(-600, 201)
+        self.queue.move_delta(1, -1)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(bytes(self.queue.flush()),
+                         bytes([PKID_CLIENT_MOVE_ABSOLUTE])
+                         + pack('!ii', -599, 200))
+
+    def test_compressed_moves(self):
+        self.queue.move_absolute(10, 10)
+        self.queue.put(PKID_CLIENT_MOVE_COMPRESSED + 1)
+        self.queue.move_absolute(0, 0)
+        self.queue.put(PKID_CLIENT_MOVE_COMPRESSED + 3)
+        self.assertEqual(bytes(self.queue.flush()),
+                         bytes([PKID_CLIENT_MOVE_ABSOLUTE]) + pack('!ii', 0, 0)
+                         + bytes([PKID_CLIENT_MOVE_COMPRESSED + 3]))
+
+    def test_custom_lanes(self):
+        lanes = {PKID_CLIENT_CHAT: 0}
+        queue = OutgoingQueue(lanes=lanes, limits={}, clock=self.clock)
+        queue.put(PKID_CLIENT_PUT_BLOCK, b'x')
+        queue.put(PKID_CLIENT_CHAT, b'y')
+        self.assertEqual(bytes(queue.flush()),
+                         bytes([PKID_CLIENT_CHAT]) + b'y'
+                         + bytes([PKID_CLIENT_PUT_BLOCK]) + b'x')
+        queue = OutgoingQueue(lanes={}, default_lane=0, clock=self.clock)
+        queue.put(PKID_CLIENT_PUT_BLOCK, b'x')
+        self.assertEqual(len(queue), 1)
+
+    def test_rate_limit(self):
+        queue = OutgoingQueue(buffer_size=1024, clock=self.clock)
+        for i in range(200):
+            queue.put(PKID_CLIENT_PUT_BLOCK, bytes([i]))
+        queue.move_delta(1, 0)
+        data = queue.flush()
+        self.assertEqual(data[0], PKID_CLIENT_MOVE_DELTA)
+        self.assertEqual(len(data), 3 + 128 * 2)
+        self.assertEqual(len(queue.flush()), 0)
+        queue.put(PKID_CLIENT_PONG)
+        self.assertEqual(bytes(queue.flush()), bytes([PKID_CLIENT_PONG]))
+        self.clock.now = 0.5
+        self.assertEqual(len(queue.flush()), 32 * 2)
+        self.assertEqual(len(queue), 200 - 128 - 32)
+
+    def test_buffer_full(self):
+        for i in range(40):
+            self.queue.put(PKID_CLIENT_PUT_BLOCK, bytes([i]))
+        self.assertEqual(len(self.queue.flush()), 64)
+        self.assertEqual(len(self.queue.flush()), 16)
+
+    def test_throttled_type_does_not_block_lane(self):
+        for i in range(11):
+            self.queue.put(PKID_CLIENT_SHOOT, bytes([i]))
+        self.queue.put(PKID_CLIENT_CHUNK_REQUEST, b'\x01')
+        self.queue.put(PKID_CLIENT_SHOOT, b'\x0b')
+        self.queue.put(0x99, b'\x02')
+        data = bytes(self.queue.flush())
+        self.assertEqual(data.count(PKID_CLIENT_SHOOT), 10)
+        self.assertEqual(data[-4:], bytes([PKID_CLIENT_CHUNK_REQUEST, 1,
+                                           0x99, 2]))
+        self.assertEqual(len(self.queue), 2)
+        self.assertEqual(len(self.queue.flush()), 0)
+        self.clock.now = 0.2
+        self.assertEqual(bytes(self.queue.flush()),
+                         bytes([PKID_CLIENT_SHOOT, 10, PKID_CLIENT_SHOOT, 11]))
+
+    def test_fold_absolute_overflow(self):
+        self.queue.move_absolute(2 ** 31 - 1, 0)
+        self.queue.move_delta(1, 0)
+        self.assertEqual(len(self.queue), 2)
+
+    def test_move_payload_size(self):
+        with self.assertRaises(ValueError):
+            self.queue.put(PKID_CLIENT_MOVE_DELTA, b'\x01')
+        self.queue.move_delta(1, 1)
+        with self.assertRaises(ValueError):
+            self.queue.put(PKID_CLIENT_MOVE_DELTA, b'\x01\x02\x03')
+        with self.assertRaises(ValueError):
+            self.queue.put(PKID_CLIENT_MOVE_ABSOLUTE, b'\x01')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, burst=2, clock=self.clock)
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.clock.now = 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+    def test_oversized(self):
+        with self.assertRaises(ValueError):
+            self.queue.put(PKID_CLIENT_CHAT, bytes(64))
+
+
+PKT_SPAWN = '20 02 0a 6861746b69646368616e fffffda8 000000c9 68 7f'
+PKT_SPAWN_OTHER = '20 03 03 626f74 00000000 00000000 62 01'
+PKT_MOVES = '24 02 00000010 00000020  21 02 fc 08  2c 03'
+PKT_BLOCKS = '33 fffffda8 000000c9 00 30 7f  31 02 00000001 00000002 01 31 05'
+PKT_CLEAR = '34 fffffda8 000000c9'
+PKT_DESPAWN = '22 03'
+
+
+def decode_all(hex_data):
+    with PacketReader(bytes.fromhex(hex_data)) as pr:
+        packets = []
+        while pr.junk:
+            packets.append(decoder.read_one(pr))
+        return packets
+
+
+class TestWorld(unittest.TestCase):
+
+    def setUp(self):
+        self.service = WorldService(snapshot_interval=3)
+
+    def feed(self, hex_data):
+        for pkt in decode_all(hex_data):
+            self.service.feed(pkt)
+        return self.service.tick()
+
+    def test_apply(self):
+        self.feed(PKT_SPAWN + PKT_SPAWN_OTHER + PKT_MOVES + PKT_BLOCKS)
+        world = self.service.world
+        self.assertEqual(world.players[2], ['hatkidchan', 12, 40, b'h', 127])
+        self.assertEqual(world.players[3], ['bot', -1, 0, b'b', 1])
+        self.assertEqual(world.cells[-600, 201], (0, b'0', 127))
+        self.assertEqual(world.cells[1, 2], (1, b'1', 5))
+        self.feed(PKT_CLEAR + PKT_DESPAWN)
+        self.assertNotIn((-600, 201), world.cells)
+        self.assertNotIn(3, world.players)
+
+    def test_push_pull(self):
+        self.feed('33 00000000 00000000 00 41 01  33 00000001 00000000 00 42 02'
+                  '33 00000005 00000005 00 43 03')
+        observer = WorldState()
+        self.service.subscribe(observer.apply_diff)
+        # push the 2x1 region at (0, 0) one cell down, then pull it back
+        delta = self.feed('e1 00000000 00000000 0002 0001 00 01')
+        world = self.service.world
+        self.assertEqual(world.cells, {
+            (0, 1): (0, b'A', 1), (1, 1): (0, b'B', 2), (5, 5): (0, b'C', 3),
+        })
+        self.assertEqual(observer.cells, world.cells)
+        self.assertEqual(len(delta), 13 + 4 * 12)
+        self.feed('e2 00000000 00000001 0002 0001 00 ff')
+        self.assertEqual(world.cells[0, 0], (0, b'A', 1))
+        self.assertNotIn((0, 1), world.cells)
+        self.assertEqual(observer.cells, world.cells)
+
+    def test_place_pushable(self):
+        self.feed('32 02 fffffda8 000000c9 ff 00 30 7f')
+        self.assertEqual(self.service.world.cells[-600, 201],
+                         (PUSHABLE_TYPE, b'0', 127))
+
+    def test_relative_move_wraps(self):
+        self.feed('20 02 00 7fffffff 80000000 68 7f  21 02 01 ff')
+        self.assertEqual(self.service.world.players[2][1:3],
+                         [-2 ** 31, 2 ** 31 - 1])
+        world = WorldState()
+        world.apply_diff(self.service.world.snapshot())
+        self.assertEqual(world.players, self.service.world.players)
+
+    def test_chunks(self):
+        observer = WorldState()
+        self.service.subscribe(observer.apply_diff)
+        self.feed('11 01 00000001 00000002 00000004  12 0002 6162'
+                  '12 0002 6364  13')
+        self.assertEqual(self.service.world.chunks, {(1, 1, 2): b'abcd'})
+        self.assertEqual(observer.chunks, self.service.world.chunks)
+        self.assertEqual(len(self.service.tick()), 13)
+        self.feed('11 01 00000001 00000002 00000001  12 0001 7a  13')
+        late = WorldState()
+        self.service.subscribe(late.apply_diff)
+        self.assertEqual(late.chunks, {(1, 1, 2): b'z'})
+
+    def test_ignored(self):
+        self.assertFalse(self.service.feed(decode_all('f0')[0]))
+        self.assertEqual(len(self.service.tick()), 13)
+
+    def test_observers(self):
+        early, late = WorldState(), WorldState()
+        self.service.subscribe(early.apply_diff)
+        self.feed(PKT_SPAWN + PKT_SPAWN_OTHER + PKT_BLOCKS)
+        self.feed(PKT_MOVES)
+        self.service.subscribe(late.apply_diff)
+        self.feed(PKT_CLEAR + PKT_DESPAWN)
+        self.feed('26 02 03 6e6577')
+        for observer in (early, late):
+            self.assertEqual(observer.tick, 4)
+            self.assertEqual(observer.cells, self.service.world.cells)
+            self.assertEqual(observer.players, self.service.world.players)
+            self.assertEqual(observer.players[2][0], 'new')
+
+    def test_snapshot_interval(self):
+        for _ in range(4):
+            self.feed(PKT_SPAWN)
+        self.assertEqual(len(self.service.deltas), 1)
+        world = WorldState()
+        world.apply_diff(self.service.snapshot)
+        self.assertEqual(world.tick, 3)
+        self.assertEqual(world.players, self.service.world.players)
+
+    def test_missed_delta(self):
+        world = WorldState()
+        self.feed(PKT_SPAWN)
+        with self.assertRaises(ValueError):
+            world.apply_diff(self.feed(PKT_DESPAWN))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -285,6 +285,50 @@ class TestPacketReader(unittest.TestCase):
             pkt = decoder.read_one(pr)
             self.assertEqual(pr.junk, b'\xaa\xbb\xcc\xdd')
 
+    def test_truncated(self):
+        for data, size in ((PKT_KICK, 5), (PKT_DATA_CHUNK, 5),
+                           (PKT_SPAWN, 7), (PKT_PLACE_BLOCK_MAP, 10)):
+            with PacketReader(bytes.fromhex(data)[:size]) as pr:
+                with self.assertRaises(EOFError):
+                    decoder.read_one(pr)
+        with PacketReader(bytes.fromhex(PKT_DATA_CHUNK[:-2]),
+                          views=True) as pr:
+            with self.assertRaises(EOFError):
+                decoder.read_one(pr)
+
+    def test_string_cache(self):
+        cache = StringCache()
+        data = bytes.fromhex(PKT_SPAWN + PKT_NICK + PKT_LOGIN)
+        with PacketReader(data, strings=cache) as pr:
+            names = [decoder.read_one(pr).name for _ in range(3)]
+            self.assertEqual(names[0], 'hatkidchan')
+            self.assertIs(names[0], names[1])
+            self.assertIs(names[0], names[2])
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_string_cache_bounded(self):
+        cache = StringCache(size=2)
+        for raw in (b'a', b'b', b'a', b'c'):
+            cache.decode(raw)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.misses, 3)
+        cache.decode(b'a')
+        self.assertEqual(cache.hits, 2)
+
+    def test_string_cache_off_by_default(self):
+        with PacketReader(bytes.fromhex(PKT_CHAT)) as pr:
+            self.assertIsNone(pr.strings)
+            self.assertEqual(decoder.read_one(pr).text, 'hello, world!')
+
+    def test_bytes16_views(self):
+        with PacketReader(bytes.fromhex(PKT_DATA_FULL), views=True) as pr:
+            decoder.read_one(pr)
+            pkt = decoder.read_one(pr)
+            self.assertIsInstance(pkt.data, memoryview)
+            self.assertEqual(pkt.data, b'0123456789')
+            self.assertIsInstance(decoder.read_one(pr), DataEndPacket)
+            self.assertEqual(pr.junk, b'')
+
 
 if __name__ == '__main__':
     unittest.main()